@@ -4,11 +4,12 @@ import re
 import sys
 from pathlib import Path
 import asyncio
+import functools
 
 root_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(root_dir))
 
-from data.db import DBManager, TrackModel
+from data.db import DBManager, JobJournal
 from backend.downloader import BaseDownloader
 from backend.spotify import SpotifyDownloader
 from backend.youtube import YoutubeDownloader
@@ -25,11 +26,12 @@ logr = log.getLogger(__name__)
 class MusicApp:
     def __init__(self):
         # 1. Инициализируем базу данных
-        self.db = DBManager("sqlite:///data/music_lib.db")
+        self.db = DBManager("sqlite:///data/db/music_lib.db")
+        self.journal = JobJournal(self.db.engine)
 
-        # 2. Инициализируем загрузчики
-        self._yt_loader = YoutubeDownloader()
-        self._sp_loader = SpotifyDownloader()
+        # 2. Инициализируем загрузчики (общие БД и журнал — одно подключение к файлу)
+        self._yt_loader = YoutubeDownloader(db=self.db, journal=self.journal)
+        self._sp_loader = SpotifyDownloader(db=self.db, journal=self.journal)
 
         # 3. КАРТА ЗАГРУЗЧИКОВ
         self.loaders_map = {
@@ -50,46 +52,76 @@ class MusicApp:
         logr.warning(f"Паттерн не найден для {url}, используем YouTube Search")
         return self.default_loader
 
+    @staticmethod
+    def _is_success(result) -> bool:
+        """Итог загрузки: bool, DownloadResult или список DownloadResult"""
+        if isinstance(result, list):
+            return bool(result) and all(MusicApp._is_success(r) for r in result)
+        return bool(getattr(result, "success", result))
+
+    async def _journal(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
     async def download_audio(self, url: str):
         """Основной метод обработки URL"""
         logr.info(f"Начало обработки: {url}")
 
         try:
+            job = await self._journal(self.journal.start, "import", url, url)
+
             # 1. Определяем загрузчик
             loader = self._get_loader(url)
 
-            # 2. Скачивание
-            track_data = await loader.download_audio(url)
-
-            # 3. Сохранение в БД
-            if track_data:
-                if isinstance(track_data, list):
-                    for track in track_data:
-                        self.db.save_data(track)
-                    logr.info(f"Сохранено {len(track_data)} треков из: {url}")
-                else:
-                    self.db.save_data(track_data)
-                    logr.info(f"Сохранен трек: {track_data.title}")
+            # 2. Скачивание (загрузчик сам сохраняет треки в БД)
+            if loader is self._sp_loader:
+                # Spotify: трек, плейлист или альбом через браузер
+                result = await loader.download_url(url)
+            else:
+                result = await loader.download_audio(url)
+
+            # 3. Фиксируем итог в журнале
+            if self._is_success(result):
+                logr.info(f"Готово: {url}")
+                await self._journal(self.journal.finish, job.id)
             else:
                 logr.warning(f"Не удалось скачать: {url}")
+                await self._journal(self.journal.fail, job.id, "загрузка не удалась")
 
         except Exception as e:
             logr.error(f"Критическая ошибка при обработке {url}: {e}")
+            await self._journal(self.journal.fail, self.journal.get_id("import", url), str(e))
+
+    async def resume_pending(self):
+        """Продолжает импорты, прерванные перезапуском. Готовые байты не скачиваются повторно."""
+        jobs = await self._journal(self.journal.pending, "import")
+        if jobs:
+            logr.info(f"Возобновление {len(jobs)} незавершённых загрузок")
+            await asyncio.gather(*(self.download_audio(job.url) for job in jobs))
+
+    async def close(self):
+        """Останавливает браузер Spotify, если он запускался"""
+        await self._sp_loader.stop()
 
 
 # Запуск
 async def main():
     app = MusicApp()
 
-    # Теперь мы можем запускать несколько загрузок одновременно!
-    tasks = [
-        app.download_audio("https://open.spotify.com/track/4cOdK2wGLETKBW3PvgPWqT"),
-        app.download_audio("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
-        app.download_audio("Never Gonna Give You Up"),
-    ]
-
-    # Ждем завершения всех задач
-    await asyncio.gather(*tasks)
+    try:
+        await app.resume_pending()
+
+        # Теперь мы можем запускать несколько загрузок одновременно!
+        tasks = [
+            app.download_audio("https://open.spotify.com/track/4cOdK2wGLETKBW3PvgPWqT"),
+            app.download_audio("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+            app.download_audio("Never Gonna Give You Up"),
+        ]
+
+        # Ждем завершения всех задач
+        await asyncio.gather(*tasks)
+    finally:
+        await app.close()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,23 @@
 from abc import ABC, abstractmethod
 from typing import Union, List
 from pathlib import Path
+import random
 import sys
 
 root_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(root_dir))
 
-from data.db import TrackModel
+from data.db import Track
+
+# Общие параметры повторных попыток загрузки
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Экспоненциальная задержка с полным джиттером: случайно в [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * 2**attempt))
 
 
 class BaseDownloader(ABC):
@@ -15,8 +26,8 @@ class BaseDownloader(ABC):
         self.save_path.mkdir(parents=True, exist_ok=True)
 
     @abstractmethod
-    async def download_audio(self, url: str) -> Union[TrackModel, List[TrackModel], None]:
+    async def download_audio(self, url: str) -> Union[Track, List[Track], None]:
         """
-        Скачивает контент и возвращает объекты TrackModel.
+        Скачивает контент и возвращает объекты Track.
         """
         pass
@@ -1,9 +1,12 @@
+import os
 import re
 import json
 import asyncio
 import base64
+import functools
 import logging as log
 import sys
+from collections import defaultdict
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Optional, Union
@@ -13,8 +16,11 @@ import aiohttp
 import aiofiles
 from playwright.async_api import async_playwright, Page, Browser, BrowserContext, TimeoutError as PlaywrightTimeout
 
-# Убираем лишний импорт БД, если он не нужен для демо
-# from data.db import DBManager
+root_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(root_dir))
+
+from data.db import DBManager, JobJournal
+from backend.downloader import MAX_ATTEMPTS, backoff_delay
 
 # Настройка логирования
 log.basicConfig(
@@ -53,11 +59,23 @@ class DownloadResult:
 class SpotifyDownloader:
     """Асинхронный парсер для скачивания треков"""
 
-    def __init__(self, folder_n: Union[str, Path] = "./data/songs", headless: bool = True):
+    def __init__(
+        self,
+        folder_n: Union[str, Path] = "./data/songs",
+        headless: bool = True,
+        db: Optional[DBManager] = None,
+        journal: Optional[JobJournal] = None,
+    ):
         self.folder_n = Path(folder_n)
         self.folder_n.mkdir(parents=True, exist_ok=True)
         self.site_url = "https://spotidown.app/en"
         self.headless = headless
+        self.db = db or DBManager("sqlite:///data/db/music_lib.db")
+        self.journal = journal or JobJournal(self.db.engine)
+        # Один файл — одна корутина: иначе обе допишут в тот же .part
+        self._file_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Страница браузера одна, поэтому ссылки Spotify обрабатываются по очереди
+        self._page_lock = asyncio.Lock()
 
         self.playwright = None
         self.browser: Optional[Browser] = None
@@ -116,42 +134,130 @@ class SpotifyDownloader:
         text = re.sub(r"\s+", " ", text)
         return text.strip()[:max_length]
 
+    @staticmethod
+    def _parse_total(response: aiohttp.ClientResponse, offset: int) -> Optional[int]:
+        """Ожидаемый полный размер файла из Content-Range / Content-Length"""
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rsplit("/", 1)[-1] if "/" in content_range else ""
+        if total.isdigit():
+            return int(total)
+        if response.content_length is not None:
+            return offset + response.content_length
+        return None
+
+    async def _journal(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
     async def download_file(self, url: str, filename: str) -> Optional[Path]:
         """
-        Асинхронное скачивание файла через aiohttp
+        Асинхронное скачивание файла через aiohttp.
+        Докачивает .part файл через Range, проверяет размер и только потом
+        переименовывает в итоговый файл. Прогресс хранится в JobJournal.
         """
         try:
-            filepath = self.folder_n / filename
-            if filepath.exists():
-                logr.debug(f"Файл существует: {filename}")
-                return filepath
-
-            logr.info(f"Скачивание (Async): {filename}")
-
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                "Referer": "https://spotidown.app/",
-            }
+            async with self._file_locks[str(self.folder_n / filename)]:
+                return await self._download_file(url, filename)
+        except Exception as e:
+            logr.error(f"Ошибка скачивания {filename}: {e}")
+            try:
+                job_id = self.journal.get_id("file", str(self.folder_n / filename))
+                await self._journal(self.journal.fail, job_id, str(e))
+            except Exception as je:
+                logr.error(f"Ошибка записи в журнал для {filename}: {je}")
+            return None
 
-            # Используем aiohttp для асинхронных запросов
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=60) as response:
-                    if response.status != 200:
-                        logr.error(f"Ошибка HTTP {response.status} для {filename}")
-                        return None
+    async def _download_file(self, url: str, filename: str) -> Optional[Path]:
+        filepath = self.folder_n / filename
+        part_path = filepath.with_name(filepath.name + ".part")
 
-                    # Читаем и пишем файл асинхронно
-                    content = await response.read()
-                    async with aiofiles.open(filepath, "wb") as f:
-                        await f.write(content)
+        job = await self._journal(self.journal.start, "file", str(filepath), url, str(filepath))
+        if job.state == JobJournal.DONE:
+            if filepath.exists() and filepath.stat().st_size == job.total_bytes:
+                logr.debug(f"Файл существует: {filename}")
+                return filepath
+            # Файл удалён или повреждён после завершения — качаем заново
+            await self._journal(self.journal.update, job.id, state=JobJournal.RUNNING, bytes_done=0)
+
+        logr.info(f"Скачивание (Async): {filename}")
+
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            "Referer": "https://spotidown.app/",
+        }
+        # Попытки считаются за вызов: после перезапуска задание снова получает MAX_ATTEMPTS
+        attempt = 0
+
+        while attempt < MAX_ATTEMPTS:
+            offset = part_path.stat().st_size if part_path.exists() else 0
+            req_headers = dict(headers)
+            if offset:
+                req_headers["Range"] = f"bytes={offset}-"
+
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url, headers=req_headers, timeout=60) as response:
+                        if response.status == 416 and offset and offset == job.total_bytes:
+                            # .part уже полный, не хватило только переименования
+                            total = offset
+                        elif response.status in (200, 206):
+                            if response.status == 200 and offset:
+                                logr.info(f"Сервер не поддерживает Range, скачиваем заново: {filename}")
+                                offset = 0
+
+                            total = self._parse_total(response, offset)
+                            if job.total_bytes and total and total != job.total_bytes and offset:
+                                # Файл на сервере изменился — докачивать нельзя
+                                part_path.unlink(missing_ok=True)
+                                raise IOError(f"размер изменился: {job.total_bytes} -> {total}")
+                            await self._journal(self.journal.update, job.id, total_bytes=total, bytes_done=offset)
+                            job.total_bytes = total
+
+                            last_saved = offset
+                            async with aiofiles.open(part_path, "ab" if offset else "wb") as f:
+                                async for chunk in response.content.iter_chunked(1 << 16):
+                                    await f.write(chunk)
+                                    offset += len(chunk)
+                                    # Сохраняем смещение в журнал не чаще раза в 1 MB
+                                    if offset - last_saved >= 1 << 20:
+                                        await f.flush()
+                                        await self._journal(self.journal.update, job.id, bytes_done=offset)
+                                        last_saved = offset
+                        elif response.status == 416:
+                            # Смещение не совпадает с файлом на сервере — начинаем с нуля
+                            part_path.unlink(missing_ok=True)
+                            raise IOError(f"HTTP {response.status}")
+                        elif response.status == 429 or response.status >= 500:
+                            raise IOError(f"HTTP {response.status}")
+                        else:
+                            logr.error(f"Ошибка HTTP {response.status} для {filename}")
+                            await self._journal(self.journal.fail, job.id, f"HTTP {response.status}")
+                            return None
+
+                size = part_path.stat().st_size
+                if total is not None and size != total:
+                    raise IOError(f"неполный файл: {size} из {total} байт")
+
+                os.replace(part_path, filepath)
+                await self._journal(self.journal.finish, job.id, bytes_done=size, total_bytes=size)
+
+                size_mb = size / 1024 / 1024
+                logr.info(f"Скачан: {filename} ({size_mb:.1f} MB)")
+                return filepath
 
-            size_mb = len(content) / 1024 / 1024
-            logr.info(f"Скачан: {filename} ({size_mb:.1f} MB)")
-            return filepath
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                attempt += 1
+                await self._journal(self.journal.fail_attempt, job.id, str(e))
+                if attempt >= MAX_ATTEMPTS:
+                    logr.warning(f"Ошибка скачивания {filename} ({attempt}/{MAX_ATTEMPTS}): {e}")
+                    break
+                delay = backoff_delay(attempt)
+                logr.warning(f"Ошибка скачивания {filename} ({attempt}/{MAX_ATTEMPTS}): {e}, повтор через {delay:.1f}с")
+                await asyncio.sleep(delay)
 
-        except Exception as e:
-            logr.error(f"Ошибка скачивания {filename}: {e}")
-            return None
+        logr.error(f"Не удалось скачать {filename} за {MAX_ATTEMPTS} попыток")
+        await self._journal(self.journal.fail, job.id, "превышено число попыток")
+        return None
 
     async def submit_url(self, spotify_url: str) -> bool:
         """Отправка URL"""
@@ -285,6 +391,20 @@ class SpotifyDownloader:
         success = audio_file is not None
         return DownloadResult(metadata, audio_file, cover_file, success=success)
 
+    async def save_track(self, result: DownloadResult, spotify_url: str) -> None:
+        """Сохраняет скачанный трек в БД"""
+        title = f"{result.track.artist} - {result.track.name}"
+        metadata = {
+            "title": result.track.name,
+            "uploader": ", ".join(result.track.artists),
+            "duration": 0,
+            "url": spotify_url,
+            "platform": "spotify",
+            "from_storage": False,
+            "filepath": str(result.audio_file),
+        }
+        await self._journal(self.db.save_data, title, metadata)
+
     async def download_playlist(self, spotify_url: str, max_tracks: int = 0) -> list[DownloadResult]:
         res = []
         if not await self.submit_url(spotify_url):
@@ -300,12 +420,14 @@ class SpotifyDownloader:
             # Перезагружаем страницу списка, если это не первый трек
             if i > 0:
                 if not await self.submit_url(spotify_url):
+                    res.append(DownloadResult(TrackMetadata("Err", []), success=False, error="URL fail"))
                     continue
 
-            result = await self.download_track(i)
+            result = await self.download_audio(i)
             res.append(result)
 
             if result.success:
+                await self.save_track(result, spotify_url)
                 logr.info(f"✓ Готово: {result.track.name}")
             else:
                 logr.error(f"✗ Ошибка: {result.error}")
@@ -317,7 +439,19 @@ class SpotifyDownloader:
     async def download_single_track(self, spotify_url: str) -> DownloadResult:
         if not await self.submit_url(spotify_url):
             return DownloadResult(TrackMetadata("Err", []), success=False, error="URL fail")
-        return await self.download_audio(0)
+        result = await self.download_audio(0)
+        if result.success:
+            await self.save_track(result, spotify_url)
+        return result
+
+    async def download_url(self, spotify_url: str) -> Union[DownloadResult, list[DownloadResult]]:
+        """Трек, плейлист или альбом по ссылке; браузер запускается при первом вызове"""
+        async with self._page_lock:
+            if not self.page and not await self.start():
+                return DownloadResult(TrackMetadata("Err", []), success=False, error="Browser fail")
+            if "/track/" in spotify_url:
+                return await self.download_single_track(spotify_url)
+            return await self.download_playlist(spotify_url)
 
 
 # === Основной блок запуска (Entry Point) ===
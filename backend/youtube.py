@@ -2,12 +2,15 @@ import yt_dlp
 import sys
 import asyncio
 import functools
+from collections import defaultdict
 from pathlib import Path
+from typing import Optional
 import logging as log
 
 root_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(root_dir))
-from data.db import DBManager, TrackMetadata, Track
+from data.db import DBManager, TrackMetadata, Track, JobJournal
+from backend.downloader import MAX_ATTEMPTS, backoff_delay
 
 
 log.basicConfig(
@@ -19,22 +22,47 @@ logr = log.getLogger(__name__)
 
 
 class YoutubeDownloader:
-    def __init__(self, db_n: str = "music_lib.db", folder_n: str = "songs"):
+    def __init__(
+        self,
+        db_n: str = "music_lib.db",
+        folder_n: str = "songs",
+        db: Optional[DBManager] = None,
+        journal: Optional[JobJournal] = None,
+    ):
         base_path = root_dir / "data"
         self.out_path = base_path / folder_n
         self.out_path.mkdir(parents=True, exist_ok=True)
 
         self.db_path = base_path / db_n
         logr.info(f"DB Path: {self.db_path}")
-        self.db = DBManager(f"sqlite:///data/db/{db_n}")
+        self.db = db or DBManager(f"sqlite:///data/db/{db_n}")
+        self.journal = journal or JobJournal(self.db.engine)
+        # Один запрос — одна корутина: иначе обе допишут в тот же .part
+        self._locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
 
     def _sync_download(self, query: str, ydl_opts: dict):
         """Внутренний синхронный метод для работы с yt_dlp"""
+        # Неполную передачу yt_dlp проверяет сам: при нехватке байт против Content-Length
+        # бросает ContentTooShortError (-> DownloadError), .part остаётся для continuedl
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info_dict = ydl.extract_info(query, download=True)
-            if info_dict and "entries" in info_dict:
-                return info_dict["entries"][0]
-            return info_dict
+
+        if info_dict and "entries" in info_dict:
+            return info_dict["entries"][0]
+        return info_dict
+
+    @staticmethod
+    def _is_permanent(e: yt_dlp.utils.DownloadError) -> bool:
+        """Ошибки, которые повтор не исправит: видео удалено, приватное, ссылка не поддерживается."""
+        cause = e.exc_info[1] if e.exc_info else None
+        return isinstance(cause, yt_dlp.utils.ExtractorError) and cause.expected
+
+    def _file_size(self, info_dict: dict) -> int:
+        """Размер итогового файла (после постобработки)"""
+        filepath = (info_dict.get("requested_downloads") or [{}])[0].get("filepath")
+        if not filepath or not Path(filepath).exists():
+            raise IOError(f"файл не найден: {filepath}")
+        return Path(filepath).stat().st_size
 
     def _extract_data(self, info_dict: dict, codec: str) -> (str, dict):
         """
@@ -64,7 +92,8 @@ class YoutubeDownloader:
 
     async def download_audio(
         self, url_query: str, post_proc: bool = False, codec: str = "mp3", qual: str = "192"
-    ) -> None:
+    ) -> bool:
+        """Скачивает трек и сохраняет его в БД. Возвращает True при успехе."""
         search: bool = not url_query.startswith(("http://", "https://"))
         query = f"ytsearch:{url_query}" if search else url_query
 
@@ -82,29 +111,81 @@ class YoutubeDownloader:
             "format": "bestaudio/best",
             "postprocessors": proc,
             "outtmpl": f"{self.out_path}/%(title)s.%(ext)s",
-            "ignoreerrors": True,
+            # Ошибки не глотаем — повторяем сами с backoff, .part докачивается через continuedl
+            "ignoreerrors": False,
+            "continuedl": True,
             "quiet": False,
             "default_search": "ytsearch",
             "noplaylist": True,  # Обычно лучше скачивать по одному треку для поиска
         }
 
+        async with self._locks[query]:
+            return await self._download_with_retries(url_query, query, ydl_opts, codec)
+
+    async def _download_with_retries(self, url_query: str, query: str, ydl_opts: dict, codec: str) -> bool:
         loop = asyncio.get_running_loop()
 
-        try:
-            # 1. Скачиваем (в отдельном потоке)
-            info_dict = await loop.run_in_executor(None, functools.partial(self._sync_download, query, ydl_opts))
+        job = await loop.run_in_executor(None, self.journal.start, "file", query, query)
+        if job.state == JobJournal.DONE:
+            if job.filepath and Path(job.filepath).exists() and Path(job.filepath).stat().st_size == job.total_bytes:
+                logr.info(f"Уже скачано: {url_query}")
+                return True
+            # Файл удалён или повреждён после завершения — качаем заново
+            await loop.run_in_executor(None, functools.partial(self.journal.update, job.id, state=JobJournal.RUNNING))
+
+        # Попытки считаются за вызов: после перезапуска задание снова получает MAX_ATTEMPTS
+        attempt = 0
+        while attempt < MAX_ATTEMPTS:
+            try:
+                # 1. Скачиваем (в отдельном потоке)
+                info_dict = await loop.run_in_executor(None, functools.partial(self._sync_download, query, ydl_opts))
+                if not info_dict:
+                    raise IOError("пустой ответ yt_dlp")
+
+                size = self._file_size(info_dict)
 
-            if info_dict:
                 # 2. Подготавливаем чистые данные для модели
                 title, clean_data = self._extract_data(info_dict, codec)
 
                 await loop.run_in_executor(None, self.db.save_data, title, clean_data)
+                await loop.run_in_executor(
+                    None,
+                    functools.partial(
+                        self.journal.finish,
+                        job.id,
+                        filepath=clean_data["filepath"],
+                        bytes_done=size,
+                        total_bytes=size,
+                    ),
+                )
 
                 logr.info(f"Успешно сохранено в БД: {clean_data['title']}")
-
-        except Exception as e:
-            logr.error(f"Ошибка при обработке {url_query}: {e}")
-            # Можно добавить raise e, если нужно, чтобы asyncio.gather ловил ошибку
+                return True
+
+            except (yt_dlp.utils.DownloadError, IOError) as e:
+                if isinstance(e, yt_dlp.utils.DownloadError) and self._is_permanent(e):
+                    logr.error(f"Загрузка невозможна {url_query}: {e}")
+                    await loop.run_in_executor(None, self.journal.fail, job.id, str(e))
+                    return False
+                attempt += 1
+                await loop.run_in_executor(None, self.journal.fail_attempt, job.id, str(e))
+                if attempt >= MAX_ATTEMPTS:
+                    logr.warning(f"Ошибка при обработке {url_query} ({attempt}/{MAX_ATTEMPTS}): {e}")
+                    break
+                delay = backoff_delay(attempt)
+                logr.warning(
+                    f"Ошибка при обработке {url_query} ({attempt}/{MAX_ATTEMPTS}): {e}, повтор через {delay:.1f}с"
+                )
+                await asyncio.sleep(delay)
+
+            except Exception as e:
+                logr.error(f"Ошибка при обработке {url_query}: {e}")
+                await loop.run_in_executor(None, self.journal.fail, job.id, str(e))
+                return False
+
+        logr.error(f"Не удалось скачать {url_query} за {MAX_ATTEMPTS} попыток")
+        await loop.run_in_executor(None, self.journal.fail, job.id, "превышено число попыток")
+        return False
 
 
 async def main():
@@ -1,10 +1,32 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, ForeignKey, Boolean
+from sqlalchemy import (
+    create_engine,
+    event,
+    insert,
+    delete,
+    select,
+    func,
+    Column,
+    String,
+    Integer,
+    DateTime,
+    ForeignKey,
+    Boolean,
+    Index,
+    PrimaryKeyConstraint,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from datetime import datetime
+from typing import Optional
 import logging as log
+import threading
 import hashlib
+import atexit
+import uuid
 
 Base = declarative_base()
+# Отдельная база для пользовательских данных (data/db/users.db)
+UserBase = declarative_base()
 
 
 class Track(Base):
@@ -33,6 +55,103 @@ class TrackMetadata(Base):
     track = relationship("Track", back_populates="metadata_info")
 
 
+class DownloadJob(Base):
+    __tablename__ = "download_jobs"
+
+    id = Column(String, primary_key=True)
+    # "import" — исходный URL/запрос пользователя, "file" — передача конкретного файла
+    kind = Column(String, nullable=False, default="file")
+    url = Column(String, nullable=False)
+    filepath = Column(String, nullable=True)
+    state = Column(String, nullable=False, default="pending")
+    bytes_done = Column(Integer, default=0)
+    total_bytes = Column(Integer, nullable=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (Index("ix_download_jobs_kind_state", "kind", "state"),)
+
+
+class JobJournal:
+    """
+    Журнал загрузок: состояние, смещение в байтах и число попыток.
+    Переживает перезапуск — незавершённые задания можно получить через pending().
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, engine):
+        # Движок общий с DBManager, чтобы не плодить соединения к одному файлу SQLite
+        self.engine = engine
+        DownloadJob.__table__.create(self.engine, checkfirst=True)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+
+    def get_id(self, kind: str, key: str) -> str:
+        return hashlib.sha256(f"{kind}:{key}".encode("utf-8")).hexdigest()[:16]
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        with self.Session() as session:
+            return session.get(DownloadJob, job_id)
+
+    def start(self, kind: str, key: str, url: str, filepath: Optional[str] = None) -> DownloadJob:
+        """Создаёт задание или возвращает существующее, переводя его в running."""
+        job_id = self.get_id(kind, key)
+        with self.Session() as session:
+            # ON CONFLICT DO NOTHING: параллельный start того же задания не падает на UNIQUE
+            session.execute(
+                sqlite_insert(DownloadJob)
+                .values(id=job_id, kind=kind, url=url, filepath=filepath, bytes_done=0, attempts=0)
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+            job = session.get(DownloadJob, job_id)
+            if job.state != self.DONE:
+                # Ссылка могла обновиться (например, подписанный URL), смещение сохраняем
+                job.url = url
+                job.filepath = filepath or job.filepath
+                job.state = self.RUNNING
+            session.commit()
+            return job
+
+    def update(self, job_id: str, **fields) -> None:
+        with self.Session() as session:
+            job = session.get(DownloadJob, job_id)
+            if not job:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            session.commit()
+
+    def fail_attempt(self, job_id: str, error: str) -> int:
+        """Увеличивает общий счётчик попыток задания и возвращает новое значение."""
+        with self.Session() as session:
+            job = session.get(DownloadJob, job_id)
+            if not job:
+                return 0
+            job.attempts = (job.attempts or 0) + 1
+            job.last_error = error[:500]
+            session.commit()
+            return job.attempts
+
+    def finish(self, job_id: str, **fields) -> None:
+        self.update(job_id, state=self.DONE, last_error=None, **fields)
+
+    def fail(self, job_id: str, error: str) -> None:
+        self.update(job_id, state=self.FAILED, last_error=error[:500])
+
+    def pending(self, kind: str = "import") -> list[DownloadJob]:
+        """Незавершённые задания; running после перезапуска означает прерванную загрузку."""
+        with self.Session() as session:
+            return session.scalars(
+                select(DownloadJob).where(
+                    DownloadJob.kind == kind, DownloadJob.state.in_([self.PENDING, self.RUNNING])
+                )
+            ).all()
+
+
 class DBManager:
     def __init__(self, db_url="sqlite:///db/music_lib.db"):
         self.engine = create_engine(db_url, connect_args={"check_same_thread": False})
@@ -77,3 +196,392 @@ class DBManager:
             except Exception as e:
                 log.error(f"Ошибка сохранения: {e}")
                 session.rollback()
+
+
+class PlayHistory(UserBase):
+    __tablename__ = "play_history"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, nullable=False)
+    track_id = Column(String, nullable=False)
+    played_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # История всегда читается "последние N для пользователя"
+    __table_args__ = (Index("ix_play_history_user_played", "user_id", "played_at"),)
+
+
+class Favorite(UserBase):
+    __tablename__ = "favorites"
+
+    user_id = Column(String, nullable=False)
+    track_id = Column(String, nullable=False)
+    title = Column(String)
+    artist = Column(String)
+    duration = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # PK (user_id, track_id) покрывает favorites/check, индекс — список избранного
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "track_id"),
+        Index("ix_favorites_user_created", "user_id", "created_at"),
+    )
+
+
+class Playlist(UserBase):
+    __tablename__ = "playlists"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    icon = Column(String, default="🎵")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    tracks = relationship("PlaylistTrack", back_populates="playlist", cascade="all, delete-orphan")
+
+    __table_args__ = (Index("ix_playlists_user_created", "user_id", "created_at"),)
+
+
+class PlaylistTrack(UserBase):
+    __tablename__ = "playlist_tracks"
+
+    playlist_id = Column(String, ForeignKey("playlists.id", ondelete="CASCADE"), nullable=False)
+    track_id = Column(String, nullable=False)
+    title = Column(String)
+    artist = Column(String)
+    position = Column(Integer, nullable=False, default=0)
+    added_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    playlist = relationship("Playlist", back_populates="tracks")
+
+    __table_args__ = (
+        PrimaryKeyConstraint("playlist_id", "track_id"),
+        Index("ix_playlist_tracks_order", "playlist_id", "position"),
+    )
+
+
+class UserDBManager:
+    """
+    Хранилище истории, избранного и плейлистов (data/db/users.db).
+
+    События прослушивания копятся в памяти и записываются пачкой в одной
+    транзакции — по размеру буфера (flush_size) или по таймеру
+    (flush_interval, сек). Чтение истории объединяет БД и буфер.
+    Избранное и плейлисты меняются редко и пишутся сразу.
+    """
+
+    def __init__(
+        self,
+        db_url="sqlite:///data/db/users.db",
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 50_000,
+    ):
+        self.engine = create_engine(db_url, connect_args={"check_same_thread": False})
+
+        if "sqlite" in db_url:
+
+            @event.listens_for(self.engine, "connect")
+            def _set_pragmas(dbapi_con, _):
+                cur = dbapi_con.cursor()
+                cur.execute("PRAGMA journal_mode=WAL;")
+                # В режиме WAL NORMAL безопасен и не делает fsync на каждый commit
+                cur.execute("PRAGMA synchronous=NORMAL;")
+                cur.execute("PRAGMA foreign_keys=ON;")
+                cur.close()
+
+        UserBase.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # Если БД долго недоступна, старые события сверх лимита отбрасываются
+        self.max_buffer = max_buffer
+
+        # _buf_lock — короткая защита буфера, _flush_lock — только сериализует запись
+        self._buf_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._history: list[dict] = []
+        # Пачка, которая сейчас пишется в БД; читатели видят её до коммита
+        self._inflight_history: list[dict] = []
+        # Нечётное значение — идёт commit; читатель повторяет чтение, если оно изменилось
+        self._commit_gen = 0
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="users-db-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # === Буферизация ===
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _trim_buffer(self) -> None:
+        """Вызывается под _buf_lock: держит буфер в пределах max_buffer."""
+        overflow = len(self._history) - self.max_buffer
+        if overflow > 0:
+            del self._history[:overflow]
+            log.warning(f"Буфер истории users.db переполнен, отброшено старых событий: {overflow}")
+
+    def flush(self) -> int:
+        """Записывает накопленные события одной транзакцией. Возвращает число записей."""
+        with self._flush_lock:
+            with self._buf_lock:
+                history, self._history = self._history, []
+                self._inflight_history = history
+
+            if not history:
+                return 0
+
+            with self.Session() as session:
+                try:
+                    session.execute(insert(PlayHistory), history)
+                    with self._buf_lock:
+                        self._commit_gen += 1
+                    try:
+                        session.commit()
+                    finally:
+                        with self._buf_lock:
+                            self._commit_gen += 1
+                            self._inflight_history = []
+                    return len(history)
+
+                except Exception as e:
+                    session.rollback()
+                    log.error(f"Ошибка записи буфера users.db, повтор при следующем сбросе: {e}")
+                    # Возвращаем события в буфер перед более новыми
+                    with self._buf_lock:
+                        self._inflight_history = []
+                        self._history = history + self._history
+                        self._trim_buffer()
+                    return 0
+
+    def close(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера."""
+        if self._stopped.is_set():
+            return
+        atexit.unregister(self.close)
+        self._stopped.set()
+        self._wakeup.set()
+        self._flusher.join()
+        self.flush()
+
+    def _read_with_pending(self, read_db, read_pending):
+        """
+        Читает БД и ещё не записанные события без ожидания flush.
+        Если во время чтения прошёл commit, повторяет; при постоянной записи ждёт её конца.
+        """
+        for _ in range(3):
+            with self._buf_lock:
+                gen = self._commit_gen
+                pending = read_pending()
+            if gen % 2:
+                continue
+            rows = read_db()
+            with self._buf_lock:
+                if self._commit_gen == gen:
+                    return rows, pending
+
+        with self._flush_lock:
+            with self._buf_lock:
+                pending = read_pending()
+            return read_db(), pending
+
+    # === История ===
+
+    def add_history(self, user_id: str, track_id: str, played_at: Optional[datetime] = None) -> None:
+        with self._buf_lock:
+            self._history.append(
+                {"user_id": user_id, "track_id": track_id, "played_at": played_at or datetime.utcnow()}
+            )
+            self._trim_buffer()
+            if len(self._history) >= self.flush_size:
+                self._wakeup.set()
+
+    def get_history(self, user_id: str, limit: int = 50) -> list[dict]:
+        """Последние прослушивания пользователя (новые первыми), включая ещё не записанные."""
+
+        def read_db():
+            with self.Session() as session:
+                return session.execute(
+                    select(PlayHistory.track_id, PlayHistory.played_at)
+                    .where(PlayHistory.user_id == user_id)
+                    .order_by(PlayHistory.played_at.desc())
+                    .limit(limit)
+                ).all()
+
+        def read_pending():
+            return [
+                {"track_id": e["track_id"], "played_at": e["played_at"]}
+                for e in self._inflight_history + self._history
+                if e["user_id"] == user_id
+            ]
+
+        rows, pending = self._read_with_pending(read_db, read_pending)
+        res = pending + [{"track_id": r.track_id, "played_at": r.played_at} for r in rows]
+        res.sort(key=lambda e: e["played_at"], reverse=True)
+        return res[:limit]
+
+    # === Избранное (пишется сразу) ===
+
+    def add_favorite(
+        self,
+        user_id: str,
+        track_id: str,
+        title: Optional[str] = None,
+        artist: Optional[str] = None,
+        duration: Optional[str] = None,
+    ) -> None:
+        stmt = sqlite_insert(Favorite).values(
+            user_id=user_id,
+            track_id=track_id,
+            title=title,
+            artist=artist,
+            duration=duration,
+            created_at=datetime.utcnow(),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "track_id"],
+            set_={"title": stmt.excluded.title, "artist": stmt.excluded.artist, "duration": stmt.excluded.duration},
+        )
+        with self.Session() as session:
+            session.execute(stmt)
+            session.commit()
+
+    def remove_favorite(self, user_id: str, track_id: str) -> None:
+        with self.Session() as session:
+            session.execute(delete(Favorite).where(Favorite.user_id == user_id, Favorite.track_id == track_id))
+            session.commit()
+
+    def is_favorite(self, user_id: str, track_id: str) -> bool:
+        with self.Session() as session:
+            return session.get(Favorite, (user_id, track_id)) is not None
+
+    def get_favorites(self, user_id: str) -> list[dict]:
+        """Избранное пользователя (новые первыми)."""
+        with self.Session() as session:
+            rows = session.scalars(
+                select(Favorite).where(Favorite.user_id == user_id).order_by(Favorite.created_at.desc())
+            ).all()
+            return [
+                {
+                    "track_id": f.track_id,
+                    "title": f.title,
+                    "artist": f.artist,
+                    "duration": f.duration,
+                    "created_at": f.created_at,
+                }
+                for f in rows
+            ]
+
+    # === Плейлисты (пишутся сразу, частота изменений низкая) ===
+
+    def create_playlist(self, user_id: str, name: str, icon: str = "🎵") -> str:
+        p_id = uuid.uuid4().hex[:16]
+        with self.Session() as session:
+            session.add(Playlist(id=p_id, user_id=user_id, name=name, icon=icon))
+            session.commit()
+        return p_id
+
+    def get_playlists(self, user_id: str) -> list[dict]:
+        with self.Session() as session:
+            playlists = session.scalars(
+                select(Playlist).where(Playlist.user_id == user_id).order_by(Playlist.created_at)
+            ).all()
+            return [
+                {"id": p.id, "name": p.name, "icon": p.icon, "created_at": p.created_at} for p in playlists
+            ]
+
+    def update_playlist(
+        self, user_id: str, playlist_id: str, name: Optional[str] = None, icon: Optional[str] = None
+    ) -> bool:
+        with self.Session() as session:
+            playlist = session.get(Playlist, playlist_id)
+            if not playlist or playlist.user_id != user_id:
+                return False
+            if name:
+                playlist.name = name
+            if icon:
+                playlist.icon = icon
+            session.commit()
+            return True
+
+    def delete_playlist(self, user_id: str, playlist_id: str) -> bool:
+        with self.Session() as session:
+            playlist = session.get(Playlist, playlist_id)
+            if not playlist or playlist.user_id != user_id:
+                return False
+            session.delete(playlist)
+            session.commit()
+            return True
+
+    def get_playlist_tracks(self, user_id: str, playlist_id: str) -> Optional[list[dict]]:
+        """Треки плейлиста по порядку или None, если плейлиста нет у пользователя."""
+        with self.Session() as session:
+            playlist = session.get(Playlist, playlist_id)
+            if not playlist or playlist.user_id != user_id:
+                return None
+            tracks = session.scalars(
+                select(PlaylistTrack)
+                .where(PlaylistTrack.playlist_id == playlist_id)
+                .order_by(PlaylistTrack.position)
+            ).all()
+            return [
+                {
+                    "track_id": t.track_id,
+                    "title": t.title,
+                    "artist": t.artist,
+                    "position": t.position,
+                    "added_at": t.added_at,
+                }
+                for t in tracks
+            ]
+
+    def add_playlist_track(
+        self,
+        user_id: str,
+        playlist_id: str,
+        track_id: str,
+        title: Optional[str] = None,
+        artist: Optional[str] = None,
+    ) -> bool:
+        with self.Session() as session:
+            playlist = session.get(Playlist, playlist_id)
+            if not playlist or playlist.user_id != user_id:
+                return False
+            if session.get(PlaylistTrack, (playlist_id, track_id)):
+                return True
+            # max + 1, а не число треков: после удаления позиции иначе совпадут
+            position = session.scalar(
+                select(func.coalesce(func.max(PlaylistTrack.position), -1) + 1).where(
+                    PlaylistTrack.playlist_id == playlist_id
+                )
+            )
+            session.add(
+                PlaylistTrack(
+                    playlist_id=playlist_id,
+                    track_id=track_id,
+                    title=title,
+                    artist=artist,
+                    position=position,
+                )
+            )
+            session.commit()
+            return True
+
+    def remove_playlist_track(self, user_id: str, playlist_id: str, track_id: str) -> bool:
+        with self.Session() as session:
+            playlist = session.get(Playlist, playlist_id)
+            if not playlist or playlist.user_id != user_id:
+                return False
+            session.execute(
+                delete(PlaylistTrack).where(
+                    PlaylistTrack.playlist_id == playlist_id, PlaylistTrack.track_id == track_id
+                )
+            )
+            session.commit()
+            return True
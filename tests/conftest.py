@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+root_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root_dir))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Рабочая папка с log/ и data/db: модули backend пишут логи по относительным путям при импорте"""
+    (tmp_path / "log").mkdir()
+    (tmp_path / "data" / "db").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def music_db(workdir):
+    from data.db import DBManager, JobJournal
+
+    db = DBManager(f"sqlite:///{workdir}/data/db/music_lib.db")
+    return db, JobJournal(db.engine)
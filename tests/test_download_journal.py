@@ -0,0 +1,163 @@
+import asyncio
+import importlib
+import threading
+
+import pytest
+import yt_dlp
+
+from data.db import JobJournal
+
+
+def test_concurrent_start_of_new_job(music_db):
+    _, journal = music_db
+    errors, barrier = [], threading.Barrier(8)
+
+    def start():
+        barrier.wait()
+        try:
+            journal.start("file", "songs/a.mp3", "http://a", "songs/a.mp3")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert journal.get(journal.get_id("file", "songs/a.mp3")).state == JobJournal.RUNNING
+
+
+def test_start_keeps_done_and_reopens_failed(music_db):
+    _, journal = music_db
+    done = journal.start("file", "a", "http://a")
+    journal.finish(done.id, total_bytes=10)
+    failed = journal.start("file", "b", "http://b")
+    journal.fail(failed.id, "HTTP 503")
+
+    assert journal.start("file", "a", "http://a2").state == JobJournal.DONE
+    reopened = journal.start("file", "b", "http://b2")
+    assert reopened.state == JobJournal.RUNNING
+    assert reopened.url == "http://b2"
+
+
+def test_pending_returns_interrupted_imports(music_db):
+    _, journal = music_db
+    running = journal.start("import", "url-1", "url-1")
+    finished = journal.start("import", "url-2", "url-2")
+    journal.finish(finished.id)
+    journal.start("file", "x", "x")
+
+    assert [job.id for job in journal.pending("import")] == [running.id]
+
+
+@pytest.fixture
+def youtube(workdir, music_db, monkeypatch):
+    module = importlib.import_module("backend.youtube")
+    delays = []
+
+    def no_backoff(attempt):
+        delays.append(attempt)
+        return 0
+
+    monkeypatch.setattr(module, "backoff_delay", no_backoff)
+    db, journal = music_db
+    loader = module.YoutubeDownloader(db=db, journal=journal)
+    loader.delays = delays
+    return loader
+
+
+def fake_download(loader, *effects):
+    """Подменяет yt_dlp: каждый вызов берёт следующий эффект (исключение или info_dict)."""
+    calls = []
+
+    def _sync_download(query, ydl_opts):
+        effect = effects[min(len(calls), len(effects) - 1)]
+        calls.append(query)
+        if isinstance(effect, Exception):
+            raise effect
+        return effect
+
+    loader._sync_download = _sync_download
+    return calls
+
+
+def download_error(cause):
+    return yt_dlp.utils.DownloadError(str(cause), exc_info=(type(cause), cause, None))
+
+
+def test_youtube_permanent_error_is_not_retried(youtube):
+    calls = fake_download(youtube, download_error(yt_dlp.utils.ExtractorError("Private video", expected=True)))
+
+    assert asyncio.run(youtube.download_audio("https://youtu.be/x")) is False
+    assert len(calls) == 1
+    assert youtube.delays == []
+    job = youtube.journal.get(youtube.journal.get_id("file", "https://youtu.be/x"))
+    assert job.state == JobJournal.FAILED
+
+
+def test_youtube_transient_error_retries_with_backoff(youtube, workdir):
+    song = workdir / "song.webm"
+    song.write_bytes(b"audio")
+    info = {"title": "Song", "webpage_url": "https://youtu.be/x", "requested_downloads": [{"filepath": str(song)}]}
+    calls = fake_download(youtube, download_error(yt_dlp.utils.ContentTooShortError(1, 2)), info)
+
+    assert asyncio.run(youtube.download_audio("https://youtu.be/x")) is True
+    assert len(calls) == 2
+    assert youtube.delays == [1]
+    job = youtube.journal.get(youtube.journal.get_id("file", "https://youtu.be/x"))
+    assert (job.state, job.total_bytes) == (JobJournal.DONE, len(b"audio"))
+
+    # Готовый файл повторно не скачивается
+    assert asyncio.run(youtube.download_audio("https://youtu.be/x")) is True
+    assert len(calls) == 2
+
+
+def test_youtube_gives_up_without_final_sleep(youtube):
+    from backend.downloader import MAX_ATTEMPTS
+
+    calls = fake_download(youtube, download_error(yt_dlp.utils.ContentTooShortError(1, 2)))
+
+    assert asyncio.run(youtube.download_audio("https://youtu.be/x")) is False
+    assert len(calls) == MAX_ATTEMPTS
+    assert youtube.delays == list(range(1, MAX_ATTEMPTS))
+
+
+@pytest.fixture
+def music_app(workdir):
+    return importlib.import_module("backend.app").MusicApp()
+
+
+@pytest.mark.parametrize("success", [True, False])
+def test_spotify_import_outcome_is_journaled(music_app, success):
+    from backend.spotify import DownloadResult, TrackMetadata
+
+    url = "https://open.spotify.com/playlist/abc"
+    seen = []
+
+    async def download_url(spotify_url):
+        seen.append(spotify_url)
+        return [
+            DownloadResult(TrackMetadata("A", ["X"]), success=True),
+            DownloadResult(TrackMetadata("B", ["Y"]), success=success),
+        ]
+
+    music_app._sp_loader.download_url = download_url
+    asyncio.run(music_app.download_audio(url))
+
+    assert seen == [url]
+    job = music_app.journal.get(music_app.journal.get_id("import", url))
+    assert job.state == (JobJournal.DONE if success else JobJournal.FAILED)
+
+
+def test_youtube_import_outcome_is_journaled(music_app):
+    async def download_audio(url):
+        return True
+
+    music_app._yt_loader.download_audio = download_audio
+    asyncio.run(music_app.download_audio("Never Gonna Give You Up"))
+
+    job = music_app.journal.get(music_app.journal.get_id("import", "Never Gonna Give You Up"))
+    assert job.state == JobJournal.DONE
+    assert music_app.journal.pending("import") == []
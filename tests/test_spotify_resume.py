@@ -0,0 +1,191 @@
+import asyncio
+import importlib
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+DATA = os.urandom(300_000)
+
+
+@pytest.fixture
+def spotify(workdir, monkeypatch):
+    module = importlib.import_module("backend.spotify")
+    delays = []
+
+    def no_backoff(attempt):
+        delays.append(attempt)
+        return 0
+
+    monkeypatch.setattr(module, "backoff_delay", no_backoff)
+    module.delays = delays
+    return module
+
+
+@pytest.fixture
+def loader(spotify, music_db, workdir):
+    db, journal = music_db
+    return spotify.SpotifyDownloader(folder_n=workdir / "songs", db=db, journal=journal)
+
+
+def serve(handler, coro_fn):
+    """Поднимает локальный HTTP-сервер и выполняет coro_fn(url)."""
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/f", handler)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            return await coro_fn(str(server.make_url("/f")))
+        finally:
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def ranged(requests, honor_range=True, data=DATA):
+    """Отдаёт data, поддерживая Range; записывает заголовок Range каждого запроса."""
+
+    async def handler(request):
+        rng = request.headers.get("Range")
+        requests.append(rng)
+        if not rng or not honor_range:
+            return web.Response(body=data)
+        start = int(rng[len("bytes=") : -1])
+        if start >= len(data):
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        return web.Response(
+            status=206,
+            body=data[start:],
+            headers={"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"},
+        )
+
+    return handler
+
+
+def part_of(loader, name):
+    return loader.folder_n / f"{name}.part"
+
+
+def test_resumes_part_file_with_range(loader):
+    part_of(loader, "a.mp3").write_bytes(DATA[:1000])
+    requests = []
+
+    path = serve(ranged(requests), lambda url: loader.download_file(url, "a.mp3"))
+
+    assert requests == ["bytes=1000-"]
+    assert path.read_bytes() == DATA
+    assert not part_of(loader, "a.mp3").exists()
+
+
+def test_resumes_after_connection_drop(loader):
+    # Смещение в журнал пишется раз в 1 MB, поэтому файл крупнее
+    data = os.urandom(3 << 20)
+    requests = []
+
+    async def handler(request):
+        if not requests:
+            requests.append(None)
+            resp = web.StreamResponse(headers={"Content-Length": str(len(data))})
+            await resp.prepare(request)
+            await resp.write(data[: 3 << 19])
+            request.transport.close()
+            return resp
+        return await ranged(requests, data=data)(request)
+
+    path = serve(handler, lambda url: loader.download_file(url, "a.mp3"))
+
+    assert len(requests) == 2
+    assert requests[1].startswith("bytes=") and requests[1] != "bytes=0-"
+    assert path.read_bytes() == data
+
+
+def test_restarts_when_range_is_ignored(loader):
+    part_of(loader, "a.mp3").write_bytes(b"x" * 1000)
+    requests = []
+
+    path = serve(ranged(requests, honor_range=False), lambda url: loader.download_file(url, "a.mp3"))
+
+    assert requests == ["bytes=1000-"]
+    assert path.read_bytes() == DATA
+
+
+def test_416_on_complete_part_promotes_file(loader):
+    filepath = loader.folder_n / "a.mp3"
+    job = loader.journal.start("file", str(filepath), "http://old", str(filepath))
+    loader.journal.update(job.id, total_bytes=len(DATA))
+    part_of(loader, "a.mp3").write_bytes(DATA)
+    requests = []
+
+    path = serve(ranged(requests), lambda url: loader.download_file(url, "a.mp3"))
+
+    assert requests == [f"bytes={len(DATA)}-"]
+    assert path.read_bytes() == DATA
+    assert loader.journal.get(job.id).state == "done"
+
+
+def test_416_on_oversized_part_starts_over(loader):
+    part_of(loader, "a.mp3").write_bytes(b"x" * (len(DATA) + 10))
+    requests = []
+
+    path = serve(ranged(requests), lambda url: loader.download_file(url, "a.mp3"))
+
+    assert requests == [f"bytes={len(DATA) + 10}-", None]
+    assert path.read_bytes() == DATA
+
+
+def test_gives_up_after_max_attempts_without_final_sleep(spotify, loader):
+    requests = []
+
+    async def handler(request):
+        requests.append(request.headers.get("Range"))
+        return web.Response(status=503)
+
+    path = serve(handler, lambda url: loader.download_file(url, "a.mp3"))
+
+    assert path is None
+    assert len(requests) == spotify.MAX_ATTEMPTS
+    # После последней попытки паузы нет
+    assert spotify.delays == list(range(1, spotify.MAX_ATTEMPTS))
+    job = loader.journal.get(loader.journal.get_id("file", str(loader.folder_n / "a.mp3")))
+    assert job.state == "failed"
+    assert not (loader.folder_n / "a.mp3").exists()
+
+
+def test_concurrent_downloads_of_same_file_transfer_once(loader):
+    requests = []
+
+    async def both(url):
+        return await asyncio.gather(loader.download_file(url, "a.mp3"), loader.download_file(url, "a.mp3"))
+
+    first, second = serve(ranged(requests), both)
+
+    assert first == second == loader.folder_n / "a.mp3"
+    assert requests == [None]
+    assert first.read_bytes() == DATA
+
+
+def test_finished_file_is_not_downloaded_again(loader):
+    requests = []
+
+    async def twice(url):
+        await loader.download_file(url, "a.mp3")
+        return await loader.download_file(url, "a.mp3")
+
+    path = serve(ranged(requests), twice)
+
+    assert requests == [None]
+    assert path.read_bytes() == DATA
+
+
+def test_save_track_writes_library_entry(spotify, loader):
+    result = spotify.DownloadResult(
+        spotify.TrackMetadata("Song", ["Artist"]), audio_file=loader.folder_n / "a.mp3", success=True
+    )
+
+    asyncio.run(loader.save_track(result, "https://open.spotify.com/track/x"))
+
+    track = loader.db.get_data(loader.db.get_id("Artist - Song"))
+    assert track.title == "Artist - Song"
@@ -0,0 +1,154 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from data.db import UserDBManager
+
+
+@pytest.fixture
+def users_db(tmp_path):
+    # Таймер выключен: сбросы в тестах только явные
+    db = UserDBManager(f"sqlite:///{tmp_path}/users.db", flush_size=10_000, flush_interval=3600)
+    yield db
+    db.close()
+
+
+def fail_history_inserts(db):
+    """Каждый INSERT в play_history падает, пока флаг не снят."""
+    state = {"fail": True}
+
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def _fail(conn, cursor, statement, *args):
+        if state["fail"] and statement.startswith("INSERT INTO play_history"):
+            raise RuntimeError("database is locked")
+
+    return state
+
+
+def track_ids(history):
+    return [e["track_id"] for e in history]
+
+
+def test_history_reads_merge_buffer_and_db(users_db):
+    users_db.add_history("u1", "t0")
+    users_db.add_history("u1", "t1")
+    assert users_db.flush() == 2
+
+    users_db.add_history("u1", "t2")
+    users_db.add_history("u2", "x")
+
+    assert track_ids(users_db.get_history("u1")) == ["t2", "t1", "t0"]
+    assert track_ids(users_db.get_history("u1", limit=2)) == ["t2", "t1"]
+    assert track_ids(users_db.get_history("u2")) == ["x"]
+
+
+def test_history_reads_see_inflight_batch(users_db):
+    users_db.add_history("u1", "t0")
+    users_db.flush()
+    users_db.add_history("u1", "t1")
+
+    inserted, release = threading.Event(), threading.Event()
+
+    @event.listens_for(users_db.engine, "after_cursor_execute")
+    def _block(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO play_history") and not release.is_set():
+            inserted.set()
+            release.wait(5)
+
+    flusher = threading.Thread(target=users_db.flush)
+    flusher.start()
+    assert inserted.wait(5)
+
+    # Пачка вставлена, но не закоммичена: она видна только из памяти, без дублей
+    assert users_db._history == []
+    assert track_ids(users_db.get_history("u1")) == ["t1", "t0"]
+
+    release.set()
+    flusher.join(5)
+    assert track_ids(users_db.get_history("u1")) == ["t1", "t0"]
+
+
+def test_history_reads_consistent_during_concurrent_flushes(users_db):
+    stop, errors = threading.Event(), []
+
+    def reader():
+        while not stop.is_set():
+            ids = track_ids(users_db.get_history("u1", limit=10**6))
+            if sorted(ids) != sorted(f"t{i}" for i in range(len(ids))):
+                errors.append(ids)
+
+    def flusher():
+        while not stop.is_set():
+            users_db.flush()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)] + [threading.Thread(target=flusher)]
+    for t in threads:
+        t.start()
+    for i in range(2000):
+        users_db.add_history("u1", f"t{i}")
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    users_db.flush()
+    assert len(users_db.get_history("u1", limit=10**6)) == 2000
+
+
+def test_failed_flush_requeues_history(users_db):
+    users_db.add_history("u1", "t0")
+    state = fail_history_inserts(users_db)
+
+    for _ in range(10):
+        assert users_db.flush() == 0
+    users_db.add_history("u1", "t1")
+
+    assert track_ids(users_db.get_history("u1")) == ["t1", "t0"]
+
+    state["fail"] = False
+    assert users_db.flush() == 2
+    assert track_ids(users_db.get_history("u1")) == ["t1", "t0"]
+
+
+def test_history_buffer_drops_oldest_beyond_limit(users_db):
+    users_db.max_buffer = 3
+    fail_history_inserts(users_db)
+
+    for i in range(5):
+        users_db.add_history("u1", f"t{i}")
+    users_db.flush()
+
+    assert track_ids(users_db.get_history("u1")) == ["t4", "t3", "t2"]
+
+
+def test_favorites_written_immediately(users_db):
+    users_db.add_favorite("u1", "a", title="A")
+    users_db.add_favorite("u1", "b")
+    users_db.add_favorite("u1", "a", title="A2")
+    users_db.remove_favorite("u1", "b")
+
+    assert users_db.is_favorite("u1", "a")
+    assert not users_db.is_favorite("u1", "b")
+    assert [(f["track_id"], f["title"]) for f in users_db.get_favorites("u1")] == [("a", "A2")]
+
+
+def test_playlist_positions_stay_unique_after_removal(users_db):
+    p_id = users_db.create_playlist("u1", "mix")
+    for t_id in "abc":
+        assert users_db.add_playlist_track("u1", p_id, t_id)
+    assert users_db.remove_playlist_track("u1", p_id, "a")
+    assert users_db.add_playlist_track("u1", p_id, "d")
+
+    tracks = users_db.get_playlist_tracks("u1", p_id)
+    assert [(t["track_id"], t["position"]) for t in tracks] == [("b", 1), ("c", 2), ("d", 3)]
+
+
+def test_playlists_check_owner(users_db):
+    p_id = users_db.create_playlist("u1", "mix")
+
+    assert users_db.get_playlist_tracks("u2", p_id) is None
+    assert not users_db.add_playlist_track("u2", p_id, "a")
+    assert not users_db.delete_playlist("u2", p_id)
+    assert [p["name"] for p in users_db.get_playlists("u1")] == ["mix"]
+    assert users_db.get_playlists("u2") == []